@@ -4,17 +4,53 @@ Script to preprocess exam videos: download transcript and create student page.
 
 Usage:
     python scripts/preprocess_exam.py YT_URL QUARTER STUDENT_SLUG
+    python scripts/preprocess_exam.py --batch BATCH_CSV
     
 Example:
     python scripts/preprocess_exam.py https://youtu.be/5Bd_onCysfw w26 alex-d
 """
 
 import argparse
+import asyncio
+import csv
+import os
 import sys
-import re
 import json
+import string
+import time
 from pathlib import Path
-from youtube_transcript_api import YouTubeTranscriptApi
+from youtube_transcript_api import YouTubeTranscriptApi, RequestBlocked, YouTubeRequestFailed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# URL prefixes that are immediately followed by the VIDEO_ID
+_YT_URL_MARKERS = ('youtube.com/watch?v=', 'youtu.be/')
+# Characters allowed in a VIDEO_ID
+_YT_ID_CHARS = frozenset(string.ascii_letters + string.digits + '_-')
+_YT_ID_LENGTH = 11
+# Maximum number of transcripts downloaded at once in batch mode
+_MAX_CONCURRENT_FETCHES = 8
+# Errors worth retrying: YouTube throttling (HTTP 429 surfaces as RequestBlocked)
+# and other failed HTTP requests. Anything else (no captions, bad ID) is final.
+_RETRYABLE_ERRORS = (RequestBlocked, YouTubeRequestFailed)
+_FETCH_ATTEMPTS = 5
+_BACKOFF_MIN_SECONDS = 1
+_BACKOFF_MAX_SECONDS = 30
+# Downloaded transcripts are cached here, keyed by video ID
+_CACHE_DIR = Path.home() / '.cache' / 'cis110-transcripts'
+_CACHE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+
+# Directories already created during this run
+_ensured_dirs = set()
+
+
+def _is_video_id(candidate):
+    """Return True if candidate looks like an 11-character YouTube video ID."""
+    return len(candidate) == _YT_ID_LENGTH and all(c in _YT_ID_CHARS for c in candidate)
 
 
 def extract_video_id(url):
@@ -25,32 +61,85 @@ def extract_video_id(url):
     - https://youtu.be/VIDEO_ID
     - VIDEO_ID (if just the ID is provided)
     """
-    # Pattern for youtube.com/watch?v=VIDEO_ID
-    pattern1 = r'(?:youtube\.com\/watch\?v=)([a-zA-Z0-9_-]{11})'
-    # Pattern for youtu.be/VIDEO_ID
-    pattern2 = r'(?:youtu\.be\/)([a-zA-Z0-9_-]{11})'
-    
-    match = re.search(pattern1, url)
-    if match:
-        return match.group(1)
-    
-    match = re.search(pattern2, url)
-    if match:
-        return match.group(1)
+    for marker in _YT_URL_MARKERS:
+        _, found, rest = url.partition(marker)
+        if found:
+            candidate = rest[:_YT_ID_LENGTH]
+            if _is_video_id(candidate):
+                return candidate
     
     # If it's already just the video ID (11 characters)
-    if re.match(r'^[a-zA-Z0-9_-]{11}$', url):
+    if _is_video_id(url):
         return url
     
     return None
 
 
-def fetch_transcript(video_url):
+def _fetch_with_retry(video_id):
+    """
+    Fetch raw transcript data, retrying throttled or failed requests with
+    exponential backoff (1s, 2s, 4s, ... capped at 30s).
+    """
+    ytt_api = YouTubeTranscriptApi()
+    for attempt in range(1, _FETCH_ATTEMPTS + 1):
+        try:
+            return ytt_api.fetch(video_id).to_raw_data()
+        except _RETRYABLE_ERRORS as e:
+            if attempt == _FETCH_ATTEMPTS:
+                raise
+            delay = min(_BACKOFF_MAX_SECONDS, _BACKOFF_MIN_SECONDS * 2 ** (attempt - 1))
+            # Emit the whole line in one write so batch worker threads don't interleave
+            print(
+                f"⚠️  Fetch for {video_id} failed ({type(e).__name__}), "
+                f"retrying in {delay}s (attempt {attempt}/{_FETCH_ATTEMPTS})\n",
+                end='',
+                file=sys.stderr
+            )
+            time.sleep(delay)
+
+
+def _cache_file(video_id):
+    return _CACHE_DIR / f'{video_id}.json'
+
+
+def _read_cached(video_id):
+    """Return cached transcript data for video_id, or None if missing or stale."""
+    cache_file = _cache_file(video_id)
+    try:
+        if time.time() - cache_file.stat().st_mtime > _CACHE_MAX_AGE_SECONDS:
+            return None
+        return json.loads(cache_file.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cached(video_id, transcript_data):
+    """Store transcript data in the cache. Failures are ignored."""
+    cache_file = _cache_file(video_id)
+    tmp_file = cache_file.with_suffix(f'.{os.getpid()}.{id(transcript_data)}.tmp')
+    try:
+        _CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_file.write_text(json.dumps(transcript_data), encoding='utf-8')
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        tmp_file.unlink(missing_ok=True)
+
+
+def _evict_cached(video_id):
+    _cache_file(video_id).unlink(missing_ok=True)
+
+
+def fetch_transcript(video_url, use_cache=True, quiet=False):
     """
     Fetch and return the transcript for a given YouTube video.
     
+    Transcripts are cached on disk for 30 days, so re-running the script for
+    the same video skips the download.
+    
     Args:
         video_url: YouTube URL or video ID
+        use_cache: If False, discard any cached copy and download again
+        quiet: Suppress per-video progress messages
     
     Returns:
         Raw transcript data (list of dicts with 'text', 'start', 'duration')
@@ -61,16 +150,115 @@ def fetch_transcript(video_url):
     if not video_id:
         raise ValueError(f"Could not extract video ID from: {video_url}")
     
-    print(f"Fetching transcript for video ID: {video_id}")
+    if use_cache:
+        transcript_data = _read_cached(video_id)
+        if transcript_data is not None:
+            if not quiet:
+                print(f"Using cached transcript for video ID: {video_id}")
+            return transcript_data
+    else:
+        _evict_cached(video_id)
     
-    # Create API instance and fetch transcript
-    ytt_api = YouTubeTranscriptApi()
-    transcript_obj = ytt_api.fetch(video_id)
+    if not quiet:
+        print(f"Fetching transcript for video ID: {video_id}")
     
-    return transcript_obj.to_raw_data()
+    transcript_data = _fetch_with_retry(video_id)
+    _write_cached(video_id, transcript_data)
+    return transcript_data
 
 
-def save_transcript(transcript_data, quarter, student_slug, base_path):
+async def fetch_transcript_async(video_url, semaphore, use_cache=True):
+    """
+    Fetch a transcript without blocking the event loop.
+    
+    youtube-transcript-api only ships a blocking client, so the fetch runs in
+    a worker thread; the semaphore caps how many run at once. Progress
+    messages are suppressed so concurrent fetches don't interleave output.
+    
+    Args:
+        video_url: YouTube URL or video ID
+        semaphore: asyncio.Semaphore limiting concurrent downloads
+        use_cache: If False, discard any cached copy and download again
+    
+    Returns:
+        Raw transcript data (list of dicts with 'text', 'start', 'duration')
+    """
+    async with semaphore:
+        return await asyncio.to_thread(fetch_transcript, video_url, use_cache, True)
+
+
+async def _process_batch(items, use_cache=True):
+    """
+    Fetch transcripts for all batch items concurrently.
+    
+    Returns a list aligned with items holding either the transcript data or
+    the exception raised while fetching it.
+    """
+    semaphore = asyncio.Semaphore(_MAX_CONCURRENT_FETCHES)
+    return await asyncio.gather(
+        *(fetch_transcript_async(url, semaphore, use_cache) for url, _, _ in items),
+        return_exceptions=True
+    )
+
+
+def read_batch_file(batch_file):
+    """
+    Read exams to preprocess from a CSV file.
+    
+    Each row is URL,QUARTER,STUDENT_SLUG. Blank lines and lines starting
+    with '#' are ignored.
+    
+    Args:
+        batch_file: Path to the CSV file
+    
+    Returns:
+        List of (url, quarter, student_slug) tuples
+    """
+    items = []
+    with open(batch_file, 'r', encoding='utf-8', newline='') as f:
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            if not row or not row[0].strip() or row[0].lstrip().startswith('#'):
+                continue
+            if len(row) != 3 or not all(cell.strip() for cell in row):
+                raise ValueError(f"{batch_file}:{line_number}: expected URL,QUARTER,STUDENT_SLUG")
+            items.append(tuple(cell.strip() for cell in row))
+    return items
+
+
+def _ensure_dir(path):
+    """Create path (and parents) once per run; later calls skip the syscalls."""
+    key = str(path)
+    if key not in _ensured_dirs:
+        path.mkdir(parents=True, exist_ok=True)
+        _ensured_dirs.add(key)
+
+
+def _write_file(path, data):
+    """Write bytes to path with raw os.write calls, bypassing buffered IO."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
+def _dump_json(data, pretty=False):
+    """
+    Serialize data to UTF-8 JSON bytes, using orjson when it is installed.
+    
+    The two encoders produce equivalent JSON, not byte-identical output
+    (e.g. orjson writes 1e-7 where json writes 1e-07, and NaN as null).
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0)
+    if pretty:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def save_transcript(transcript_data, quarter, student_slug, base_path, pretty=False):
     """
     Save transcript data to JSON file.
     
@@ -79,15 +267,15 @@ def save_transcript(transcript_data, quarter, student_slug, base_path):
         quarter: Quarter identifier (e.g., 'w26')
         student_slug: Student identifier (e.g., 'alex-d')
         base_path: Base path to the public directory
+        pretty: Indent the JSON for humans instead of writing it compactly
     """
     # Create transcripts directory structure
     transcript_dir = base_path / 'transcripts' / quarter
-    transcript_dir.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(transcript_dir)
     
     # Save transcript JSON
     transcript_file = transcript_dir / f'{student_slug}.json'
-    with open(transcript_file, 'w', encoding='utf-8') as f:
-        json.dump(transcript_data, f, indent=2)
+    _write_file(transcript_file, _dump_json(transcript_data, pretty))
     
     print(f"✓ Transcript saved to: {transcript_file}")
     return transcript_file
@@ -105,7 +293,7 @@ def create_student_page(video_url, quarter, student_slug, base_path):
     """
     # Create student directory structure
     student_dir = base_path / 'textbook' / 'students' / quarter / student_slug
-    student_dir.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(student_dir)
     
     # Create markdown content with ExamBrowser component
     transcript_path = f'/transcripts/{quarter}/{student_slug}.json'
@@ -113,13 +301,69 @@ def create_student_page(video_url, quarter, student_slug, base_path):
     
     # Save markdown file
     markdown_file = student_dir / f'{student_slug}.md'
-    with open(markdown_file, 'w', encoding='utf-8') as f:
-        f.write(markdown_content)
+    _write_file(markdown_file, markdown_content.encode('utf-8'))
     
     print(f"✓ Student page created at: {markdown_file}")
     return markdown_file
 
 
+def write_exam(transcript_data, video_url, quarter, student_slug, base_path, pretty=False):
+    """
+    Save a fetched transcript and create the matching student page.
+    
+    Args:
+        transcript_data: Transcript data to save
+        video_url: YouTube URL
+        quarter: Quarter identifier (e.g., 'w26')
+        student_slug: Student identifier (e.g., 'alex-d')
+        base_path: Base path to the public directory
+        pretty: Indent the transcript JSON for humans
+    """
+    # Save transcript
+    print("💾 Saving transcript...")
+    save_transcript(transcript_data, quarter, student_slug, base_path, pretty)
+    print()
+    
+    # Create student page
+    print("📄 Creating student page...")
+    create_student_page(video_url, quarter, student_slug, base_path)
+    print()
+    
+    print("✅ Done! You can now view the page at:")
+    print(f"   /textbook/students/{quarter}/{student_slug}/{student_slug}")
+
+
+def run_batch(batch_file, base_path, use_cache=True, pretty=False):
+    """
+    Preprocess every exam listed in a batch CSV file.
+    
+    Transcripts are downloaded concurrently, then written one student at a
+    time so output stays readable.
+    
+    Returns:
+        Number of exams that failed
+    """
+    items = read_batch_file(batch_file)
+    print(f"\n⏳ Fetching {len(items)} transcripts...")
+    results = asyncio.run(_process_batch(items, use_cache))
+    
+    failures = 0
+    for (url, quarter, student_slug), result in zip(items, results):
+        print(f"\n📺 Processing exam for {student_slug} ({quarter})")
+        print(f"   Video: {url}\n")
+        try:
+            if isinstance(result, Exception):
+                raise result
+            print(f"✓ Retrieved {len(result)} transcript segments\n")
+            write_exam(result, url, quarter, student_slug, base_path, pretty)
+        except Exception as e:
+            print(f"❌ Error: {e}", file=sys.stderr)
+            failures += 1
+    
+    print(f"\n{len(items) - failures}/{len(items)} exams preprocessed")
+    return failures
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Preprocess exam video: download transcript and create student page',
@@ -128,21 +372,25 @@ def main():
 Examples:
   %(prog)s "https://www.youtube.com/watch?v=dQw4w9WgXcQ" w26 jenna
   %(prog)s "https://youtu.be/5Bd_onCysfw" w26 alex-d
+  %(prog)s --batch exams.csv
         """
     )
     
     parser.add_argument(
         'url',
+        nargs='?',
         help='YouTube video URL or video ID'
     )
     
     parser.add_argument(
         'quarter',
+        nargs='?',
         help='Quarter identifier (e.g., w26, s26)'
     )
     
     parser.add_argument(
         'student_slug',
+        nargs='?',
         help='Student identifier/slug (e.g., jenna, alex-d)'
     )
     
@@ -153,7 +401,39 @@ Examples:
         help='Base path to the public directory (default: ../public relative to script)'
     )
     
+    parser.add_argument(
+        '--batch',
+        type=Path,
+        help='CSV file of URL,QUARTER,STUDENT_SLUG rows to preprocess concurrently'
+    )
+    
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Ignore cached transcripts and download them again'
+    )
+    
+    parser.add_argument(
+        '--pretty',
+        action='store_true',
+        help='Write indented transcript JSON (default: compact)'
+    )
+    
     args = parser.parse_args()
+    use_cache = not args.no_cache
+    
+    if args.batch:
+        if args.url or args.quarter or args.student_slug:
+            parser.error('--batch cannot be combined with URL QUARTER STUDENT_SLUG')
+        try:
+            failures = run_batch(args.batch, args.base_path, use_cache, args.pretty)
+        except Exception as e:
+            print(f"\n❌ Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(1 if failures else 0)
+    
+    if not (args.url and args.quarter and args.student_slug):
+        parser.error('URL, QUARTER and STUDENT_SLUG are required unless --batch is given')
     
     try:
         print(f"\n📺 Processing exam for {args.student_slug} ({args.quarter})")
@@ -161,21 +441,12 @@ Examples:
         
         # Fetch transcript
         print("⏳ Fetching transcript...")
-        transcript_data = fetch_transcript(args.url)
+        transcript_data = fetch_transcript(args.url, use_cache)
         print(f"✓ Retrieved {len(transcript_data)} transcript segments\n")
         
-        # Save transcript
-        print("💾 Saving transcript...")
-        save_transcript(transcript_data, args.quarter, args.student_slug, args.base_path)
-        print()
-        
-        # Create student page
-        print("📄 Creating student page...")
-        create_student_page(args.url, args.quarter, args.student_slug, args.base_path)
-        print()
-        
-        print("✅ Done! You can now view the page at:")
-        print(f"   /textbook/students/{args.quarter}/{args.student_slug}/{args.student_slug}")
+        write_exam(
+            transcript_data, args.url, args.quarter, args.student_slug, args.base_path, args.pretty
+        )
         
     except Exception as e:
         print(f"\n❌ Error: {e}", file=sys.stderr)